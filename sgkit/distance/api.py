@@ -1,7 +1,9 @@
+import math
 import typing
 
 import dask.array as da
 import numpy as np
+from dask.system import CPU_COUNT
 from typing_extensions import Literal
 
 from sgkit.distance import metrics
@@ -94,7 +96,7 @@ def pairwise_distance(
 
     >>> x = np.array([[6, 4, 1,], [4, 5, 2], [9, 7, 3]])
     >>> pairwise_distance(x, metric='correlation').compute()
-    array([[-4.44089210e-16,  2.62956526e-01,  2.82353505e-03],
+    array([[-2.22044605e-16,  2.62956526e-01,  2.82353505e-03],
            [ 2.62956526e-01,  0.00000000e+00,  2.14285714e-01],
            [ 2.82353505e-03,  2.14285714e-01,  0.00000000e+00]])
     """
@@ -117,6 +119,12 @@ def pairwise_distance(
     x = da.asarray(x)
     if x.ndim != 2:
         raise ValueError(f"2-dimensional array expected, got '{x.ndim}'")
+    if device == "cpu" and x.numblocks == (1, 1):
+        # A single chunk would be calculated by a single task on one core, so
+        # its rows are split for the pairs of blocks to run in parallel. This
+        # is preferred to parallel kernels, as those would be launched from
+        # the threads of dask's scheduler.
+        x = x.rechunk({0: max(1, math.ceil(x.shape[0] / CPU_COUNT))})
 
     # setting this variable outside of _pairwise to avoid it's recreation
     # in every iteration, which eventually leads to increase in dask
@@ -124,7 +132,10 @@ def pairwise_distance(
     metric_param = np.empty(n_map_param, dtype=x.dtype)
 
     def _pairwise_cpu(f: ArrayLike, g: ArrayLike) -> ArrayLike:
-        result: ArrayLike = map_func(f[:, None, :], g, metric_param)
+        # Comparing nan (missing) values in the vectorized kernels raises
+        # the floating point invalid flag, which is expected here
+        with np.errstate(invalid="ignore"):
+            result = map_func(f, g, metric_param)
         # Adding a new axis to help combine chunks along this axis in the
         # reduction step (see the _aggregate and _combine functions below).
         return result[..., np.newaxis]
@@ -137,16 +148,64 @@ def pairwise_distance(
     if device == "gpu":
         pairwise_func = _pairwise_gpu  # pragma: no cover
 
+    # The distance matrix is symmetric, so only the pairs of blocks on or
+    # above the diagonal are calculated, the others are filled with zeros
+    # (which are discarded by triu at the end). The index of the block of
+    # every row is passed along with the vectors to tell the pairs apart.
+    row_blocks = da.from_array(
+        np.repeat(np.arange(x.numblocks[0]), x.chunks[0]), chunks=(x.chunks[0],)
+    )
+
+    def _upper_blocks(
+        func: typing.Callable[[ArrayLike, ArrayLike], ArrayLike],
+        shape: typing.Tuple[int, ...],
+        dtype: np.dtype,
+    ) -> typing.Callable[..., ArrayLike]:
+        def _func(
+            f: ArrayLike, g: ArrayLike, f_block: ArrayLike, g_block: ArrayLike
+        ) -> ArrayLike:
+            if f_block.size and g_block.size and f_block[0] > g_block[0]:
+                return np.zeros((f.shape[0], g.shape[0]) + shape, dtype=dtype)
+            return func(f, g)
+
+        return _func
+
+    if device == "gpu" and x.numblocks[1] == 1:  # pragma: no cover
+        # With a single chunk along the vectors the reduce step has nothing
+        # to aggregate, so the map and reduce steps are fused in one kernel,
+        # which avoids copying the map step output back from the GPU.
+        fused_func = getattr(metrics, f"{metric}_{device}")
+        fused_dtype = x.dtype if x.dtype.kind == "f" else np.dtype(np.float64)
+        r = da.blockwise(
+            _upper_blocks(fused_func, (), fused_dtype),
+            "ij",
+            x,
+            "ik",
+            x,
+            "jk",
+            row_blocks,
+            "i",
+            row_blocks,
+            "j",
+            dtype=fused_dtype,
+            concatenate=True,
+        )
+        return da.triu(r) + da.triu(r, 1).T
+
     # concatenate in blockwise leads to high memory footprints, so instead
     # we perform blockwise without contraction followed by reduction.
     # More about this issue: https://github.com/dask/dask/issues/6874
     out = da.blockwise(
-        pairwise_func,
+        _upper_blocks(pairwise_func, (n_map_param, 1), x.dtype),
         "ijk",
         x,
         "ik",
         x,
         "jk",
+        row_blocks,
+        "i",
+        row_blocks,
+        "j",
         dtype=x.dtype,
         concatenate=False,
     )
@@ -193,5 +252,5 @@ def pairwise_distance(
         name="pairwise",
     )
 
-    t = da.triu(r)
-    return t + t.T
+    # Mirror the upper triangle, without adding the diagonal twice
+    return da.triu(r) + da.triu(r, 1).T
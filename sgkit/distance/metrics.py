@@ -5,11 +5,13 @@ suffixed by 'reduce'. An entry for the same should be added in the N_MAP_PARAM
 dictionary below.
 """
 
+import itertools
 import math
-from typing import Any
+import threading
+from typing import Any, List, Tuple
 
 import numpy as np
-from numba import cuda, guvectorize, types
+from numba import cuda, guvectorize, njit, types
 
 from sgkit.typing import ArrayLike
 
@@ -19,31 +21,137 @@ N_MAP_PARAM = {
     "euclidean": 1,
 }
 
+# LLVM fast-math flags for the CPU kernels. The "nnan" and "ninf" flags are
+# deliberately left out: NaN is treated as a missing value, so the comparisons
+# used to skip missing values must keep their IEEE semantics.
+FASTMATH_FLAGS = {"nsz", "arcp", "contract", "afn", "reassoc"}
+
+# The CUDA kernels assign a warp to each pair of vectors, the threads of the
+# warp stride through the vectors together and their partial values are then
+# summed with warp shuffles. A block holds WARPS_PER_BLOCK such warps.
+WARP_SIZE = 32
+WARPS_PER_BLOCK = 8
+# All the warps of a block share the same row of x, which is staged in shared
+# memory SHARED_TILE_SIZE elements at a time (one element per thread, for a
+# block of WARPS_PER_BLOCK warps).
+SHARED_TILE_SIZE = WARP_SIZE * WARPS_PER_BLOCK
+
+# The calls of call_metric_kernel take turns on a pool of N_STREAMS CUDA
+# streams, so that the transfers and kernels of the chunks which dask
+# calculates concurrently can overlap with each other. The streams are
+# created on first use, so that importing this module doesn't need a GPU.
+N_STREAMS = 8
+_streams: List[Any] = []
+_streams_lock = threading.Lock()
+_stream_counter = itertools.count()
+
+# The CPU map kernels calculate all the pairs of two chunks in tiles of
+# TILE_SIZE x TILE_SIZE vectors, so that the vectors of a tile stay in cache
+# while they are compared with each other.
+TILE_SIZE = 32
+
+# The dense euclidean map step recalculates directly the squared distances
+# which are smaller than this fraction of the sum of the squared norms of the
+# (centered) vectors, as the matrix multiplication loses too much precision
+# for them.
+DENSE_EUCLIDEAN_TOLERANCE = 1e-6
+
+# The int8 euclidean kernel sums the squared differences in int32 (which
+# vectorizes much better than int64 or float64), over blocks of at most
+# INT8_SUM_BLOCK_SIZE elements so that the partial sums can't overflow.
+INT8_SUM_BLOCK_SIZE = np.iinfo(np.int32).max // (127 * 127)
+
+
+def _no_missing(x: ArrayLike) -> bool:
+    """Checks that the given chunk has no negative or nan values."""
+    return bool((x >= 0).all())
+
+
+@guvectorize(  # type: ignore
+    [
+        "void(float32[:, :], float32[:, :], float32[:], float32[:, :, :])",
+        "void(float64[:, :], float64[:, :], float64[:], float64[:, :, :])",
+    ],
+    "(m, n),(p, n),(q)->(m, p, q)",
+    nopython=True,
+    cache=True,
+    fastmath=FASTMATH_FLAGS,
+    boundscheck=False,
+)
+def _euclidean_map_cpu(
+    x: ArrayLike, y: ArrayLike, _: ArrayLike, out: ArrayLike
+) -> None:  # pragma: no cover
+    """Euclidean distance "map" function for all the pairs of partial vectors
+    of two floating point chunks.
+
+    Parameters
+    ----------
+    x
+        [array-like, shape: (m, n)]
+        An array chunk, whose rows are partial vectors
+    y
+        [array-like, shape: (p, n)]
+        Another array chunk, whose rows are partial vectors
+    _
+        A dummy variable to map the size of output
+    out
+        [array-like, shape: (m, p, 1)]
+        The output array, which has the squared sum of partial vector pairs.
+
+    Returns
+    -------
+    An ndarray, which contains the output of the calculation of the application
+    of euclidean distance on the given pair of chunks, without the aggregation.
+    """
+    m = x.shape[0]
+    p = y.shape[0]
+    n = x.shape[1]
+    for i0 in range(0, m, TILE_SIZE):
+        for j0 in range(0, p, TILE_SIZE):
+            for i in range(i0, min(i0 + TILE_SIZE, m)):
+                for j in range(j0, min(j0 + TILE_SIZE, p)):
+                    square_sum = 0.0
+                    # Ignore missing values, selecting rather than branching
+                    # lets the loop be vectorized
+                    for k in range(n):
+                        valid = (x[i, k] >= 0) & (y[j, k] >= 0)
+                        diff = (x[i, k] - y[j, k]) if valid else 0.0
+                        square_sum += diff * diff
+                    out[i, j, 0] = square_sum
+
 
 @guvectorize(  # type: ignore
     [
-        "void(float32[:], float32[:], float32[:], float32[:])",
-        "void(float64[:], float64[:], float64[:], float64[:])",
-        "void(int8[:], int8[:], int8[:], float64[:])",
+        "void(int8[:, :], int8[:, :], int8[:], int64[:, :, :])",
     ],
-    "(n),(n),(p)->(p)",
+    "(m, n),(p, n),(q)->(m, p, q)",
     nopython=True,
     cache=True,
+    fastmath=FASTMATH_FLAGS,
+    boundscheck=False,
 )
-def euclidean_map_cpu(
+def _euclidean_map_int8_cpu(
     x: ArrayLike, y: ArrayLike, _: ArrayLike, out: ArrayLike
 ) -> None:  # pragma: no cover
-    """Euclidean distance "map" function for partial vector pairs.
+    """Euclidean distance "map" function for all the pairs of partial vectors
+    of two int8 chunks.
+
+    This is the same as `_euclidean_map_cpu`, except that the squared sums are
+    calculated with integer arithmetic, which is both exact and faster than
+    converting every element to floating point.
 
     Parameters
     ----------
     x
-        An array chunk, a partial vector
+        [array-like, shape: (m, n)]
+        An array chunk, whose rows are partial vectors
     y
-        Another array chunk, a partial vector
+        [array-like, shape: (p, n)]
+        Another array chunk, whose rows are partial vectors
     _
         A dummy variable to map the size of output
     out
+        [array-like, shape: (m, p, 1)]
         The output array, which has the squared sum of partial vector pairs.
 
     Returns
@@ -51,13 +159,26 @@ def euclidean_map_cpu(
     An ndarray, which contains the output of the calculation of the application
     of euclidean distance on the given pair of chunks, without the aggregation.
     """
-    square_sum = 0.0
     m = x.shape[0]
-    # Ignore missing values
-    for i in range(m):
-        if x[i] >= 0 and y[i] >= 0:
-            square_sum += (x[i] - y[i]) ** 2
-    out[:] = square_sum
+    p = y.shape[0]
+    n = x.shape[1]
+    zero = np.int32(0)
+    for i0 in range(0, m, TILE_SIZE):
+        for j0 in range(0, p, TILE_SIZE):
+            for i in range(i0, min(i0 + TILE_SIZE, m)):
+                for j in range(j0, min(j0 + TILE_SIZE, p)):
+                    square_sum = 0
+                    for k0 in range(0, n, INT8_SUM_BLOCK_SIZE):
+                        partial_sum = zero
+                        for k in range(k0, min(k0 + INT8_SUM_BLOCK_SIZE, n)):
+                            xk = np.int32(x[i, k])
+                            yk = np.int32(y[j, k])
+                            # Ignore missing values
+                            valid = (xk >= zero) & (yk >= zero)
+                            diff = np.int32(xk - yk) if valid else zero
+                            partial_sum = np.int32(partial_sum + diff * diff)
+                        square_sum += partial_sum
+                    out[i, j, 0] = square_sum
 
 
 def euclidean_reduce_cpu(v: ArrayLike) -> ArrayLike:  # pragma: no cover
@@ -74,34 +195,161 @@ def euclidean_reduce_cpu(v: ArrayLike) -> ArrayLike:  # pragma: no cover
     An ndarray, which contains square root of the sum of the squared sums obtained from
     the map step of `euclidean_map`.
     """
-    out: ArrayLike = np.sqrt(np.einsum("ijkl -> ij", v))
+    out: ArrayLike = np.sqrt(v.sum(axis=(2, 3)))
     return out
 
 
+def euclidean_map_dense_cpu(x: ArrayLike, y: ArrayLike) -> ArrayLike:
+    """Euclidean distance "map" function for a pair of chunks without any
+    missing values.
+
+    This uses the identity ||x - y||^2 = ||x||^2 + ||y||^2 - 2 * x.y, which
+    turns the calculation into a matrix multiplication.
+
+    Parameters
+    ----------
+    x
+        [array-like, shape: (m, n)]
+    y
+        [array-like, shape: (p, n)]
+
+    Returns
+    -------
+    An ndarray of shape (m, p, 1), which contains the squared sum of the
+    partial vector pairs, in the same form as `_euclidean_map_cpu`.
+    """
+    # The identity is prone to cancellation, so always calculate in float64,
+    # on vectors centered on the mean of x: the distances don't change when
+    # both chunks are translated, but a large common offset would cancel out
+    xf = x.astype(np.float64, copy=False)
+    shift = xf.mean(axis=0)
+    xf = xf - shift
+    yf = xf if y is x else y.astype(np.float64, copy=False) - shift
+    x_sq = np.einsum("ij,ij->i", xf, xf)
+    y_sq = x_sq if y is x else np.einsum("ij,ij->i", yf, yf)
+    norms = x_sq[:, None] + y_sq[None, :]
+    out = norms - 2 * (xf @ yf.T)
+    # The identity is still inaccurate for pairs of vectors which are much
+    # closer to each other than to the center (e.g. a vector and itself), so
+    # those are calculated directly
+    rows, cols = np.nonzero(out <= DENSE_EUCLIDEAN_TOLERANCE * norms)
+    _euclidean_square_sums(xf, yf, rows, cols, out)
+    result: ArrayLike = out.astype(x.dtype, copy=False)[..., np.newaxis]
+    return result
+
+
+@njit(  # type: ignore
+    cache=True,
+    fastmath=FASTMATH_FLAGS,
+    boundscheck=False,
+)
+def _euclidean_square_sums(
+    x: ArrayLike, y: ArrayLike, rows: ArrayLike, cols: ArrayLike, out: ArrayLike
+) -> None:  # pragma: no cover
+    for t in range(rows.shape[0]):
+        i = rows[t]
+        j = cols[t]
+        square_sum = 0.0
+        for k in range(x.shape[1]):
+            diff = x[i, k] - y[j, k]
+            square_sum += diff * diff
+        out[i, j] = square_sum
+
+
+def euclidean_map_cpu(x: ArrayLike, y: ArrayLike, param: ArrayLike) -> ArrayLike:
+    """Euclidean distance "map" function for all the pairs of partial vectors
+    of two chunks.
+
+    Floating point chunks without missing values are calculated with a
+    matrix multiplication (see `euclidean_map_dense_cpu`), int8 chunks with
+    integer arithmetic and all other chunks with the element-wise kernel.
+
+    Parameters
+    ----------
+    x
+        [array-like, shape: (m, n)]
+        An array chunk, whose rows are partial vectors
+    y
+        [array-like, shape: (p, n)]
+        Another array chunk, whose rows are partial vectors
+    param
+        A dummy variable to map the size of output
+
+    Returns
+    -------
+    An ndarray of shape (m, p, 1), which contains the squared sum of the
+    partial vector pairs.
+    """
+    result: ArrayLike
+    if x.dtype.kind == "f" and _no_missing(x) and _no_missing(y):
+        result = euclidean_map_dense_cpu(x, y)
+    elif x.dtype == np.int8:
+        result = _euclidean_map_int8_cpu(x, y, param)
+    else:
+        result = _euclidean_map_cpu(x, y, param)
+    return result
+
+
+def correlation_map_cpu(x: ArrayLike, y: ArrayLike, param: ArrayLike) -> ArrayLike:
+    """Pearson correlation "map" function for all the pairs of partial vectors
+    of two chunks.
+
+    int8 chunks are calculated with integer arithmetic, all other chunks
+    with the floating point kernel.
+
+    Parameters
+    ----------
+    x
+        [array-like, shape: (m, n)]
+        An array chunk, whose rows are partial vectors
+    y
+        [array-like, shape: (p, n)]
+        Another array chunk, whose rows are partial vectors
+    param
+        A dummy variable to map the size of output
+
+    Returns
+    -------
+    An ndarray of shape (m, p, 6), which contains the output of pearson
+    correlation on the given pair of chunks, without the aggregation.
+    """
+    result: ArrayLike
+    if x.dtype == np.int8:
+        result = _correlation_map_int8_cpu(x, y, param)
+    else:
+        result = _correlation_map_cpu(x, y, param)
+    return result
+
+
 @guvectorize(  # type: ignore
     [
-        "void(float32[:], float32[:], float32[:], float32[:])",
-        "void(float64[:], float64[:], float64[:], float64[:])",
-        "void(int8[:], int8[:], int8[:], float64[:])",
+        "void(float32[:, :], float32[:, :], float32[:], float32[:, :, :])",
+        "void(float64[:, :], float64[:, :], float64[:], float64[:, :, :])",
     ],
-    "(n),(n),(p)->(p)",
+    "(m, n),(p, n),(q)->(m, p, q)",
     nopython=True,
     cache=True,
+    fastmath=FASTMATH_FLAGS,
+    boundscheck=False,
 )
-def correlation_map_cpu(
+def _correlation_map_cpu(
     x: ArrayLike, y: ArrayLike, _: ArrayLike, out: ArrayLike
 ) -> None:  # pragma: no cover
-    """Pearson correlation "map" function for partial vector pairs.
+    """Pearson correlation "map" function for all the pairs of partial vectors
+    of two floating point chunks.
 
     Parameters
     ----------
     x
-        An array chunk, a partial vector
+        [array-like, shape: (m, n)]
+        An array chunk, whose rows are partial vectors
     y
-        Another array chunk, a partial vector
+        [array-like, shape: (p, n)]
+        Another array chunk, whose rows are partial vectors
     _
         A dummy variable to map the size of output
     out
+        [array-like, shape: (m, p, 6)]
         The output array, which has the output of pearson correlation.
 
     Returns
@@ -111,88 +359,185 @@ def correlation_map_cpu(
     """
 
     m = x.shape[0]
-    valid_indices = np.zeros(m, dtype=np.float64)
-
-    for i in range(m):
-        if x[i] >= 0 and y[i] >= 0:
-            valid_indices[i] = 1
-
-    valid_shape = valid_indices.sum()
-    _x = np.zeros(int(valid_shape), dtype=x.dtype)
-    _y = np.zeros(int(valid_shape), dtype=y.dtype)
-
-    # Ignore missing values
-    valid_idx = 0
-    for i in range(valid_indices.shape[0]):
-        if valid_indices[i] > 0:
-            _x[valid_idx] = x[i]
-            _y[valid_idx] = y[i]
-            valid_idx += 1
-
-    out[:] = np.array(
-        [
-            np.sum(_x),
-            np.sum(_y),
-            np.sum(_x * _x),
-            np.sum(_y * _y),
-            np.sum(_x * _y),
-            len(_x),
-        ]
-    )
+    p = y.shape[0]
+    n = x.shape[1]
+    for i0 in range(0, m, TILE_SIZE):
+        for j0 in range(0, p, TILE_SIZE):
+            for i in range(i0, min(i0 + TILE_SIZE, m)):
+                for j in range(j0, min(j0 + TILE_SIZE, p)):
+                    # Accumulate all the moments in a single pass, rather than
+                    # compacting the valid values into temporary arrays first.
+                    v0 = 0.0
+                    v1 = 0.0
+                    v2 = 0.0
+                    v3 = 0.0
+                    v4 = 0.0
+                    v5 = 0.0
+                    # Ignore missing values, selecting rather than branching
+                    # lets the loop be vectorized
+                    for k in range(n):
+                        valid = (x[i, k] >= 0) & (y[j, k] >= 0)
+                        xk = x[i, k] if valid else 0.0
+                        yk = y[j, k] if valid else 0.0
+                        v0 += xk
+                        v1 += yk
+                        v2 += xk * xk
+                        v3 += yk * yk
+                        v4 += xk * yk
+                        v5 += valid
+                    out[i, j, 0] = v0
+                    out[i, j, 1] = v1
+                    out[i, j, 2] = v2
+                    out[i, j, 3] = v3
+                    out[i, j, 4] = v4
+                    out[i, j, 5] = v5
 
 
 @guvectorize(  # type: ignore
     [
-        "void(float32[:, :], float32[:])",
-        "void(float64[:, :], float64[:])",
+        "void(int8[:, :], int8[:, :], int8[:], float64[:, :, :])",
     ],
-    "(p, m)->()",
+    "(m, n),(p, n),(q)->(m, p, q)",
     nopython=True,
     cache=True,
+    fastmath=FASTMATH_FLAGS,
+    boundscheck=False,
 )
-def correlation_reduce_cpu(v: ArrayLike, out: ArrayLike) -> None:  # pragma: no cover
-    """Corresponding "reduce" function for pearson correlation
+def _correlation_map_int8_cpu(
+    x: ArrayLike, y: ArrayLike, _: ArrayLike, out: ArrayLike
+) -> None:  # pragma: no cover
+    """Pearson correlation "map" function for all the pairs of partial vectors
+    of two int8 chunks.
+
+    This is the same as `_correlation_map_cpu`, except that the moments are
+    summed with integer arithmetic, which is both exact and faster than
+    converting every element to floating point.
+
     Parameters
     ----------
-    v
-        The correlation array on which pearson corrections has been
-        applied on chunks
+    x
+        [array-like, shape: (m, n)]
+        An array chunk, whose rows are partial vectors
+    y
+        [array-like, shape: (p, n)]
+        Another array chunk, whose rows are partial vectors
+    _
+        A dummy variable to map the size of output
     out
-        An ndarray, which is a symmetric matrix of pearson correlation
+        [array-like, shape: (m, p, 6)]
+        The output array, which has the output of pearson correlation.
+    """
+    m = x.shape[0]
+    p = y.shape[0]
+    n = x.shape[1]
+    zero = np.int32(0)
+    for i0 in range(0, m, TILE_SIZE):
+        for j0 in range(0, p, TILE_SIZE):
+            for i in range(i0, min(i0 + TILE_SIZE, m)):
+                for j in range(j0, min(j0 + TILE_SIZE, p)):
+                    v0 = 0
+                    v1 = 0
+                    v2 = 0
+                    v3 = 0
+                    v4 = 0
+                    v5 = 0
+                    for k0 in range(0, n, INT8_SUM_BLOCK_SIZE):
+                        # None of the moments can overflow an int32 within a
+                        # block, as no product exceeds 127 * 127
+                        w0 = zero
+                        w1 = zero
+                        w2 = zero
+                        w3 = zero
+                        w4 = zero
+                        w5 = zero
+                        for k in range(k0, min(k0 + INT8_SUM_BLOCK_SIZE, n)):
+                            xk = np.int32(x[i, k])
+                            yk = np.int32(y[j, k])
+                            # Ignore missing values
+                            valid = (xk >= zero) & (yk >= zero)
+                            xk = xk if valid else zero
+                            yk = yk if valid else zero
+                            w0 = np.int32(w0 + xk)
+                            w1 = np.int32(w1 + yk)
+                            w2 = np.int32(w2 + xk * xk)
+                            w3 = np.int32(w3 + yk * yk)
+                            w4 = np.int32(w4 + xk * yk)
+                            w5 = np.int32(w5 + valid)
+                        v0 += w0
+                        v1 += w1
+                        v2 += w2
+                        v3 += w3
+                        v4 += w4
+                        v5 += w5
+                    out[i, j, 0] = v0
+                    out[i, j, 1] = v1
+                    out[i, j, 2] = v2
+                    out[i, j, 3] = v3
+                    out[i, j, 4] = v4
+                    out[i, j, 5] = v5
+
+
+def correlation_reduce_cpu(v: ArrayLike) -> ArrayLike:  # pragma: no cover
+    """Corresponding "reduce" function for pearson correlation.
+
+    Parameters
+    ----------
+    v
+        [array-like, shape: (M, N, P, 6)]
+        The correlation array on which map step of pearson correlation has
+        been applied, where P is the number of chunks along the reduced axis.
 
     Returns
     -------
-    An ndarray, which contains the result of the calculation of the application
-    of euclidean distance on all the chunks.
+    An ndarray of shape (M, N), which contains the result of the calculation of
+    the application of pearson correlation on all the chunks.
     """
-    v = v.sum(axis=0)
-    n = v[5]
-    num = n * v[4] - v[0] * v[1]
-    denom1 = np.sqrt(n * v[2] - v[0] ** 2)
-    denom2 = np.sqrt(n * v[3] - v[1] ** 2)
+    v = v.sum(axis=-2)
+    n = v[..., 5]
+    num = n * v[..., 4] - v[..., 0] * v[..., 1]
+    # The variances can come out slightly negative instead of zero, because
+    # of cancellation for (nearly) constant vectors
+    denom1 = np.sqrt(np.maximum(n * v[..., 2] - v[..., 0] ** 2, 0))
+    denom2 = np.sqrt(np.maximum(n * v[..., 3] - v[..., 1] ** 2, 0))
     denom = denom1 * denom2
-    value = np.nan
-    if denom > 0:
-        value = 1 - (num / denom)
-    out[0] = value
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out: ArrayLike = np.where(denom > 0, 1 - (num / denom), np.nan)
+    return out
+
+
+def _next_stream() -> Any:  # pragma: no cover.
+    with _streams_lock:
+        if not _streams:
+            _streams.extend(cuda.stream() for _ in range(N_STREAMS))
+    return _streams[next(_stream_counter) % N_STREAMS]
+
+
+def _next_power_of_two(n: int) -> int:
+    return 1 << (n - 1).bit_length()
 
 
 def call_metric_kernel(
-    f: ArrayLike, g: ArrayLike, metric: str, metric_kernel: Any
+    f: ArrayLike, g: ArrayLike, metric: str, metric_kernel: Any, fused: bool = False
 ) -> ArrayLike:  # pragma: no cover.
     # Numba's 0.54.0 version is required, which is not released yet
     # We install numba from numba conda channel: conda install -c numba/label/dev numba
     # Relevant issue https://github.com/numba/numba/issues/6824
+    # A chunk paired with itself (on the diagonal of the distance matrix) is
+    # only copied to the device once, and only half of its pairs calculated
+    symmetric = f is g
     f = np.ascontiguousarray(f)
-    g = np.ascontiguousarray(g)
-
-    # move input data to the device
-    d_a = cuda.to_device(f)
-    d_b = cuda.to_device(g)
-    # create output data on the device
-    out = np.zeros((f.shape[0], g.shape[0], N_MAP_PARAM[metric]), dtype=f.dtype)
-    d_out = cuda.to_device(out)
-
+    g = f if symmetric else np.ascontiguousarray(g)
+    if fused:
+        # The kernel calculates the distances themselves, rather than the
+        # parameters of the map step
+        out_shape: Tuple[int, ...] = (f.shape[0], g.shape[0])
+        out_dtype = f.dtype if f.dtype.kind == "f" else np.float64
+    else:
+        out_shape = (f.shape[0], g.shape[0], N_MAP_PARAM[metric])
+        out_dtype = f.dtype
+    if 0 in out_shape:
+        # Nothing to calculate, and a kernel can't be launched with 0 blocks
+        return np.empty(out_shape, dtype=out_dtype)
     # https://docs.nvidia.com/cuda/cuda-c-programming-guide/index.html#features-and-technical-specifications__technical-specifications-per-compute-capability
     # These apply to compute capability 2.0 and higher and all GPUs NVIDIA has
     # shipped in the past 10+ years have compute capability > 3.0.
@@ -200,32 +545,118 @@ def call_metric_kernel(
     # from numba import cuda
     # cuda.get_current_device().compute_capability
 
-    # In future when we have an average GPU with ability to have
-    # more number of threads per block, we can increase this to that value
-    # or parameterise this from the pairwise function or get the maximum
-    # possible value for a given compute capability.
-
-    threads_per_block = (32, 32)
+    # Each warp calculates one (x, y) pair, so the x dimension of a block
+    # is a warp and the y dimension enumerates the pairs handled by a block.
+    # The rows of x are laid out along the x dimension of the grid, which
+    # allows up to 2^31 - 1 of them; the y dimension allows up to 65535
+    # blocks, i.e. 65535 * warps_per_block rows of y.
+
+    # Blocks of 8 warps (256 threads) leave room for several blocks per
+    # multiprocessor, but fewer warps are used when there are fewer rows of
+    # y, so that no warps are idle.
+    warps_per_block = min(WARPS_PER_BLOCK, _next_power_of_two(out_shape[1]))
+    threads_per_block = (WARP_SIZE, warps_per_block)
     blocks_per_grid = (
-        math.ceil(out.shape[0] / threads_per_block[0]),
-        math.ceil(out.shape[1] / threads_per_block[1]),
+        out_shape[0],
+        math.ceil(out_shape[1] / warps_per_block),
     )
 
-    metric_kernel[blocks_per_grid, threads_per_block](d_a, d_b, d_out)
+    # The transfers and the kernel are all queued on one stream of the pool,
+    # and only synchronised with once at the end. Neither the inputs nor the
+    # output are page-locked: the inputs may be views sharing memory with
+    # other chunks (or with each other), which can't be registered more than
+    # once, and allocating page-locked memory for every output costs more
+    # than it saves on the copy, besides keeping it locked until the reduce
+    # step.
+    stream = _next_stream()
+    # move input data to the device
+    d_a = cuda.to_device(f, stream=stream)
+    d_b = d_a if symmetric else cuda.to_device(g, stream=stream)
+    # create output data on the device, the kernel writes every element
+    # so it doesn't need to be initialised (or copied from the host)
+    d_out = cuda.device_array(out_shape, dtype=out_dtype, stream=stream)
+
+    metric_kernel[blocks_per_grid, threads_per_block, stream](
+        d_a, d_b, d_out, symmetric
+    )
     # copy the output array back to the host system
-    d_out_host = d_out.copy_to_host()
-    return d_out_host
+    out = d_out.copy_to_host(stream=stream)
+    stream.synchronize()
+    return out
+
+
+@cuda.jit(device=True)  # type: ignore
+def _warp_sum(value: float) -> float:  # pragma: no cover.
+    """Sums the given value over all the threads of a warp, using a butterfly
+    reduction so that every thread ends up with the total."""
+    offset = types.uint32(WARP_SIZE // 2)
+    while offset > types.uint32(0):
+        value += cuda.shfl_xor_sync(0xFFFFFFFF, value, offset)
+        offset = types.uint32(offset // types.uint32(2))
+    return value
 
 
 @cuda.jit(device=True)  # type: ignore
 def _correlation(
-    x: ArrayLike, y: ArrayLike, out: ArrayLike
-) -> None:  # pragma: no cover.
-    # Note: assigning variable and only saving the final value in the
-    # array made this significantly faster.
+    x_tile: ArrayLike,
+    y: ArrayLike,
+    start: int,
+    lane: int,
+    v0: float,
+    v1: float,
+    v2: float,
+    v3: float,
+    v4: float,
+    v5: float,
+) -> Tuple[float, float, float, float, float, float]:  # pragma: no cover.
+    # Note: accumulating in variables and only saving the final values in
+    # the output array made this significantly faster.
 
     # aggressively making all variables explicitly typed
     # makes it more performant by a factor of ~2-3x
+    m = types.uint32(min(SHARED_TILE_SIZE, y.shape[types.uint32(0)] - start))
+    # The threads of the warp read consecutive elements (coalesced loads)
+    # and stride through the tile by the warp size.
+    i = types.uint32(lane)
+    step = types.uint32(WARP_SIZE)
+
+    zero = types.uint32(0)
+    fzero = types.float32(0)
+
+    while i < m:
+        xi = x_tile[i]
+        yi = y[start + i]
+        # Missing values are selected away instead of branched on, so that
+        # all the threads of a warp execute the same instructions. Note that
+        # masking by multiplication would not work, since nan * 0 is nan.
+        valid = (xi >= zero) & (yi >= zero)
+        xi = xi if valid else fzero
+        yi = yi if valid else fzero
+        v0 += xi
+        v1 += yi
+        v2 += xi * xi
+        v3 += yi * yi
+        v4 += xi * yi
+        v5 += types.float32(valid)
+        i = types.uint32(i + step)
+
+    return v0, v1, v2, v3, v4, v5
+
+
+@cuda.jit(device=True)  # type: ignore
+def _correlation_moments(
+    x: ArrayLike, y: ArrayLike, i1: int, i2: int, calculate: bool
+) -> Tuple[float, float, float, float, float, float]:  # pragma: no cover.
+    """Calculates the correlation moments of x[i1] and y[i2] with the calling
+    warp, see call_metric_kernel for the launch layout. The moments are only
+    calculated when `calculate` is set, and are zeros otherwise."""
+    lane = types.uint32(cuda.threadIdx.x)
+    tid = types.uint32(cuda.threadIdx.y * cuda.blockDim.x + cuda.threadIdx.x)
+    n_threads = types.uint32(cuda.blockDim.x * cuda.blockDim.y)
+    m = types.uint32(x.shape[types.uint32(1)])
+
+    x_tile = cuda.shared.array(SHARED_TILE_SIZE, dtype=x.dtype)
+
     v0 = types.float32(0)
     v1 = types.float32(0)
     v2 = types.float32(0)
@@ -233,44 +664,108 @@ def _correlation(
     v4 = types.float32(0)
     v5 = types.float32(0)
 
-    m = types.uint32(x.shape[types.uint32(0)])
-    i = types.uint32(0)
+    start = types.uint32(0)
+    while start < m:
+        k = tid
+        while k < types.uint32(SHARED_TILE_SIZE) and start + k < m:
+            x_tile[k] = x[i1, start + k]
+            k = types.uint32(k + n_threads)
+        cuda.syncthreads()
+        if calculate:
+            v0, v1, v2, v3, v4, v5 = _correlation(
+                x_tile, y[i2], start, lane, v0, v1, v2, v3, v4, v5
+            )
+        # Wait for all the warps before overwriting the tile
+        cuda.syncthreads()
+        start = types.uint32(start + types.uint32(SHARED_TILE_SIZE))
+
+    if calculate:
+        v0 = _warp_sum(v0)
+        v1 = _warp_sum(v1)
+        v2 = _warp_sum(v2)
+        v3 = _warp_sum(v3)
+        v4 = _warp_sum(v4)
+        v5 = _warp_sum(v5)
+
+    return v0, v1, v2, v3, v4, v5
 
-    zero = types.uint32(0)
 
-    while i < m:
-        if x[i] >= zero and y[i] >= zero:
-            v0 += x[i]
-            v1 += y[i]
-            v2 += x[i] * x[i]
-            v3 += y[i] * y[i]
-            v4 += x[i] * y[i]
-            v5 += 1
-        i = types.uint32(i + types.uint32(1))
-
-    out[0] = v0
-    out[1] = v1
-    out[2] = v2
-    out[3] = v3
-    out[4] = v4
-    out[5] = v5
+@cuda.jit  # type: ignore
+def correlation_map_kernel(
+    x: ArrayLike, y: ArrayLike, out: ArrayLike, symmetric: bool
+) -> None:  # pragma: no cover.
+    # One warp per (x, y) pair, see call_metric_kernel for the launch layout
+    i1 = types.uint32(cuda.blockIdx.x)
+    i2 = types.uint32(cuda.blockIdx.y * cuda.blockDim.y + cuda.threadIdx.y)
+    lane = types.uint32(cuda.threadIdx.x)
+
+    out_shape_0 = types.uint32(out.shape[types.uint32(0)])
+    out_shape_1 = types.uint32(out.shape[types.uint32(1)])
+
+    # Warps outside of the valid output array boundary can't quit early, as
+    # all the threads of the block take part in staging the tiles of x. This
+    # always applies to a whole warp, so the warp shuffles are safe.
+    in_bounds = i1 < out_shape_0 and i2 < out_shape_1
+    # For a chunk paired with itself only the upper triangle is calculated,
+    # the lower one is left with zeros
+    calculate = in_bounds and (i1 <= i2 or not symmetric)
+
+    v0, v1, v2, v3, v4, v5 = _correlation_moments(x, y, i1, i2, calculate)
+
+    if in_bounds and lane == types.uint32(0):
+        out[i1, i2, 0] = v0
+        out[i1, i2, 1] = v1
+        out[i1, i2, 2] = v2
+        out[i1, i2, 3] = v3
+        out[i1, i2, 4] = v4
+        out[i1, i2, 5] = v5
 
 
 @cuda.jit  # type: ignore
-def correlation_map_kernel(
-    x: ArrayLike, y: ArrayLike, out: ArrayLike
+def correlation_kernel(
+    x: ArrayLike, y: ArrayLike, out: ArrayLike, symmetric: bool
 ) -> None:  # pragma: no cover.
-    i1 = types.uint32(cuda.grid(2)[types.uint32(0)])
-    i2 = types.uint32(cuda.grid(2)[types.uint32(1)])
+    """Pearson correlation CUDA kernel, which fuses the map and reduce steps.
+
+    This is only valid when x and y are not chunked along the vectors, so
+    that there is nothing to aggregate over, and avoids returning the
+    (m, p, 6) intermediate array of the map step.
+
+    Parameters
+    ----------
+    x
+        [array-like, shape: (m, n)]
+    y
+        [array-like, shape: (p, n)]
+    out
+        [array-like, shape: (m, p)]
+        The array for returning the result.
+    symmetric
+        Whether x and y are the same chunk, in which case only the upper
+        triangle of the output is calculated.
+    """
+    i1 = types.uint32(cuda.blockIdx.x)
+    i2 = types.uint32(cuda.blockIdx.y * cuda.blockDim.y + cuda.threadIdx.y)
+    lane = types.uint32(cuda.threadIdx.x)
 
     out_shape_0 = types.uint32(out.shape[types.uint32(0)])
     out_shape_1 = types.uint32(out.shape[types.uint32(1)])
+    in_bounds = i1 < out_shape_0 and i2 < out_shape_1
+    calculate = in_bounds and (i1 <= i2 or not symmetric)
 
-    if i1 >= out_shape_0 or i2 >= out_shape_1:
-        # Quit if (x, y) is outside of valid output array boundary
-        return
+    v0, v1, v2, v3, v4, v5 = _correlation_moments(x, y, i1, i2, calculate)
 
-    _correlation(x[i1], y[i2], out[i1][i2])
+    if in_bounds and lane == types.uint32(0):
+        # Same as correlation_reduce_cpu, for a single chunk
+        n = v5
+        num = n * v4 - v0 * v1
+        denom = math.sqrt(max(n * v2 - v0 * v0, 0)) * math.sqrt(
+            max(n * v3 - v1 * v1, 0)
+        )
+        if denom > 0:
+            out[i1, i2] = 1 - (num / denom)
+        else:
+            out[i1, i2] = math.nan
 
 
 def correlation_map_gpu(x: ArrayLike, y: ArrayLike) -> ArrayLike:  # pragma: no cover.
@@ -292,7 +787,26 @@ def correlation_map_gpu(x: ArrayLike, y: ArrayLike) -> ArrayLike:  # pragma: no
     return call_metric_kernel(x, y, "correlation", correlation_map_kernel)
 
 
-def correlation_reduce_gpu(v: ArrayLike) -> None:  # pragma: no cover.
+def correlation_gpu(x: ArrayLike, y: ArrayLike) -> ArrayLike:  # pragma: no cover.
+    """Pearson correlation distance between all pairs of vectors on GPU, with
+    the map and reduce steps fused in a single kernel.
+
+    Parameters
+    ----------
+    x
+        [array-like, shape: (m, n)]
+    y
+        [array-like, shape: (p, n)]
+
+    Returns
+    -------
+    An ndarray of shape (m, p), which contains the correlation distance of
+    the given pair of chunks. Only valid when the vectors are not chunked.
+    """
+    return call_metric_kernel(x, y, "correlation", correlation_kernel, fused=True)
+
+
+def correlation_reduce_gpu(v: ArrayLike) -> ArrayLike:  # pragma: no cover.
     """GPU implementation of the corresponding "reduce" function for pearson
     correlation.
 
@@ -308,47 +822,92 @@ def correlation_reduce_gpu(v: ArrayLike) -> None:  # pragma: no cover.
     An ndarray, which contains the result of the calculation of the reduction step
     of correlation metric.
     """
-    return correlation_reduce_cpu(v)  # type: ignore
+    return correlation_reduce_cpu(v)
 
 
 @cuda.jit(device=True)  # type: ignore
 def _euclidean_distance_map(
-    a: ArrayLike, b: ArrayLike, out: ArrayLike
-) -> None:  # pragma: no cover.
+    a_tile: ArrayLike, b: ArrayLike, start: int, lane: int, square_sum: float
+) -> float:  # pragma: no cover.
     """Helper function for the map step of euclidean distance which runs on
-    the device (GPU) itself.
+    the device (GPU) itself. It is called by all the threads of a warp, which
+    cooperatively calculate the result, one tile at a time.
 
     Parameters
     ----------
-    a
-        [array-like, shape: (1, n)]
+    a_tile
+        [array-like, shape: (SHARED_TILE_SIZE,)]
+        The current tile of the first vector, in shared memory.
     b
         [array-like, shape: (1, n)]
-    out
-        [array-like, shape: (1)]
-        The output array for returning the result.
+    start
+        The offset of the tile in the vectors.
+    lane
+        The index of the calling thread within its warp.
+    square_sum
+        The squared sum of the calling thread so far.
 
     Returns
     -------
-    An ndarray, which contains the squared sum of the corresponding elements
-    of the given pair of vectors.
+    The squared sum of the calling thread, updated with its share of the
+    corresponding elements of the tile.
     """
+    zero = types.uint32(0)
+    m = types.uint32(min(SHARED_TILE_SIZE, b.shape[types.uint32(0)] - start))
+    i = types.uint32(lane)
+    step = types.uint32(WARP_SIZE)
+
+    fzero = types.float32(0)
+
+    while i < m:
+        ai = a_tile[i]
+        bi = b[start + i]
+        # Select instead of branch to avoid warp divergence on missing values
+        valid = (ai >= zero) & (bi >= zero)
+        diff = (ai - bi) if valid else fzero
+        square_sum += diff * diff
+        i = types.uint32(i + step)
+
+    return square_sum
+
+
+@cuda.jit(device=True)  # type: ignore
+def _euclidean_square_sum(
+    x: ArrayLike, y: ArrayLike, i1: int, i2: int, calculate: bool
+) -> float:  # pragma: no cover.
+    """Calculates the squared sum of x[i1] and y[i2] with the calling warp,
+    see call_metric_kernel for the launch layout. The squared sum is only
+    calculated when `calculate` is set, and is zero otherwise."""
+    lane = types.uint32(cuda.threadIdx.x)
+    tid = types.uint32(cuda.threadIdx.y * cuda.blockDim.x + cuda.threadIdx.x)
+    n_threads = types.uint32(cuda.blockDim.x * cuda.blockDim.y)
+    m = types.uint32(x.shape[types.uint32(1)])
+
+    x_tile = cuda.shared.array(SHARED_TILE_SIZE, dtype=x.dtype)
+
     square_sum = types.float32(0)
 
-    zero = types.uint32(0)
-    a_shape_0 = types.uint32(a.shape[types.uint32(0)])
-    i = types.uint32(0)
+    start = types.uint32(0)
+    while start < m:
+        k = tid
+        while k < types.uint32(SHARED_TILE_SIZE) and start + k < m:
+            x_tile[k] = x[i1, start + k]
+            k = types.uint32(k + n_threads)
+        cuda.syncthreads()
+        if calculate:
+            square_sum = _euclidean_distance_map(x_tile, y[i2], start, lane, square_sum)
+        # Wait for all the warps before overwriting the tile
+        cuda.syncthreads()
+        start = types.uint32(start + types.uint32(SHARED_TILE_SIZE))
 
-    while i < a_shape_0:
-        if a[i] >= zero and b[i] >= zero:
-            square_sum += (a[i] - b[i]) ** types.uint32(2)
-        i = types.uint32(i + types.uint32(1))
-    out[0] = square_sum
+    if calculate:
+        square_sum = _warp_sum(square_sum)
+    return square_sum
 
 
 @cuda.jit  # type: ignore
 def euclidean_map_kernel(
-    x: ArrayLike, y: ArrayLike, out: ArrayLike
+    x: ArrayLike, y: ArrayLike, out: ArrayLike, symmetric: bool
 ) -> None:  # pragma: no cover.
     """Euclidean map CUDA kernel.
 
@@ -361,6 +920,9 @@ def euclidean_map_kernel(
     out
         [array-like, shape: (m, p, 1)]
         The zeros array of shape (m, p, 1) for returning the result.
+    symmetric
+        Whether x and y are the same chunk, in which case only the upper
+        triangle of the output is calculated.
 
     Returns
     -------
@@ -369,18 +931,64 @@ def euclidean_map_kernel(
     """
     # Aggresive typecasting of all the variables is done to improve performance.
 
-    # Unique index of the thread in the whole grid.
-    i1 = types.uint32(cuda.grid(2)[types.uint32(0)])
-    i2 = types.uint32(cuda.grid(2)[types.uint32(1)])
+    # One warp per (x, y) pair, see call_metric_kernel for the launch layout
+    i1 = types.uint32(cuda.blockIdx.x)
+    i2 = types.uint32(cuda.blockIdx.y * cuda.blockDim.y + cuda.threadIdx.y)
+    lane = types.uint32(cuda.threadIdx.x)
+
+    out_shape_0 = types.uint32(out.shape[types.uint32(0)])
+    out_shape_1 = types.uint32(out.shape[types.uint32(1)])
+
+    # We may spin up more threads than we need, but the warps outside of the
+    # valid output array boundary can't quit early, as all the threads of the
+    # block take part in staging the tiles of x. This always applies to a
+    # whole warp, so the warp shuffles are safe.
+    in_bounds = i1 < out_shape_0 and i2 < out_shape_1
+    # For a chunk paired with itself only the upper triangle is calculated,
+    # the lower one is left with zeros
+    calculate = in_bounds and (i1 <= i2 or not symmetric)
+
+    square_sum = _euclidean_square_sum(x, y, i1, i2, calculate)
+
+    if in_bounds and lane == types.uint32(0):
+        out[i1, i2, 0] = square_sum
+
+
+@cuda.jit  # type: ignore
+def euclidean_kernel(
+    x: ArrayLike, y: ArrayLike, out: ArrayLike, symmetric: bool
+) -> None:  # pragma: no cover.
+    """Euclidean distance CUDA kernel, which fuses the map and reduce steps.
+
+    This is only valid when x and y are not chunked along the vectors, so
+    that there is nothing to aggregate over.
+
+    Parameters
+    ----------
+    x
+        [array-like, shape: (m, n)]
+    y
+        [array-like, shape: (p, n)]
+    out
+        [array-like, shape: (m, p)]
+        The array for returning the result.
+    symmetric
+        Whether x and y are the same chunk, in which case only the upper
+        triangle of the output is calculated.
+    """
+    i1 = types.uint32(cuda.blockIdx.x)
+    i2 = types.uint32(cuda.blockIdx.y * cuda.blockDim.y + cuda.threadIdx.y)
+    lane = types.uint32(cuda.threadIdx.x)
 
     out_shape_0 = types.uint32(out.shape[types.uint32(0)])
     out_shape_1 = types.uint32(out.shape[types.uint32(1)])
+    in_bounds = i1 < out_shape_0 and i2 < out_shape_1
+    calculate = in_bounds and (i1 <= i2 or not symmetric)
+
+    square_sum = _euclidean_square_sum(x, y, i1, i2, calculate)
 
-    if i1 >= out_shape_0 or i2 >= out_shape_1:
-        # Quit if (x, y) is outside of valid output array boundary
-        # This is required because we may spin up more threads than we need.
-        return
-    _euclidean_distance_map(x[i1], y[i2], out[i1][i2])
+    if in_bounds and lane == types.uint32(0):
+        out[i1, i2] = math.sqrt(square_sum)
 
 
 def euclidean_map_gpu(x: ArrayLike, y: ArrayLike) -> ArrayLike:  # pragma: no cover.
@@ -402,6 +1010,25 @@ def euclidean_map_gpu(x: ArrayLike, y: ArrayLike) -> ArrayLike:  # pragma: no co
     return call_metric_kernel(x, y, "euclidean", euclidean_map_kernel)
 
 
+def euclidean_gpu(x: ArrayLike, y: ArrayLike) -> ArrayLike:  # pragma: no cover.
+    """Euclidean distance between all pairs of vectors on GPU, with the map
+    and reduce steps fused in a single kernel.
+
+    Parameters
+    ----------
+    x
+        [array-like, shape: (m, n)]
+    y
+        [array-like, shape: (p, n)]
+
+    Returns
+    -------
+    An ndarray of shape (m, p), which contains the euclidean distance of the
+    given pair of chunks. Only valid when the vectors are not chunked.
+    """
+    return call_metric_kernel(x, y, "euclidean", euclidean_kernel, fused=True)
+
+
 def euclidean_reduce_gpu(v: ArrayLike) -> ArrayLike:  # pragma: no cover.
     """GPU Implementation of the Corresponding "reduce" function for euclidean
     distance.
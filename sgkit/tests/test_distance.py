@@ -1,5 +1,6 @@
 import typing
 
+import dask
 import dask.array as da
 import numpy as np
 import pytest
@@ -88,7 +89,7 @@ def create_distance_matrix(
             marks=pytest.mark.gpu if device == "gpu" else "",
         )
         for shape in [(30, 30), (15, 30), (30, 15)]
-        for chunks in [(10, 10), (5, 10), (10, 5)]
+        for chunks in [(10, 10), (5, 10), (10, 5), (5, 30)]
         for device in ["cpu", "gpu"]
         for metric in ["euclidean", "correlation"]
     ],
@@ -135,6 +136,37 @@ def test_distance_ndarray() -> None:
     np.testing.assert_almost_equal(distance_matrix, expected_matrix)
 
 
+@pytest.mark.parametrize(
+    "dtype, chunk, decimal",
+    [
+        ("f8", (25, 10), 7),
+        ("f8", (20, 100), 7),
+        ("f4", (25, 10), 4),
+    ],
+)
+def test_euclidean_no_missing_values(
+    dtype: str, chunk: typing.Tuple[int, int], decimal: int
+) -> None:
+    x = get_vectors(array_type="np", dtype=dtype)
+    distance_matrix = pairwise_distance(da.from_array(x, chunks=chunk))
+    expected_matrix = squareform(pdist(x.astype("f8")))
+    np.testing.assert_almost_equal(distance_matrix, expected_matrix, decimal)
+    np.testing.assert_array_equal(np.diag(distance_matrix), 0)
+
+
+@pytest.mark.parametrize("offset", [1e4, 1e6])
+def test_euclidean_no_missing_values__offset(offset: float) -> None:
+    # A large common offset and duplicate vectors are ill-conditioned for the
+    # matrix multiplication used when there are no missing values
+    rs = np.random.RandomState(0)
+    x = rs.rand(40, 200) * 1e-3 + offset
+    x[10] = x[5]
+    distance_matrix = pairwise_distance(da.from_array(x, chunks=(20, 200)))
+    expected_matrix = squareform(pdist(x))
+    np.testing.assert_allclose(distance_matrix, expected_matrix, rtol=1e-6)
+    assert distance_matrix[5, 10] == 0
+
+
 @pytest.mark.parametrize(
     "metric, metric_func, dtype, device",
     [
@@ -175,12 +207,14 @@ def test_missing_values(
     "metric, dtype, expected, device",
     [
         ("euclidean", "i8", "float64", "cpu"),
+        ("euclidean", "i1", "float64", "cpu"),
         ("euclidean", "f4", "float32", "cpu"),
         ("euclidean", "f8", "float64", "cpu"),
         pytest.param("euclidean", "i8", "float64", "gpu", marks=pytest.mark.gpu),
         pytest.param("euclidean", "f4", "float32", "gpu", marks=pytest.mark.gpu),
         pytest.param("euclidean", "f8", "float64", "gpu", marks=pytest.mark.gpu),
         ("correlation", "i8", "float64", "cpu"),
+        ("correlation", "i1", "float64", "cpu"),
         ("correlation", "f4", "float32", "cpu"),
         ("correlation", "f8", "float64", "cpu"),
         pytest.param("correlation", "i8", "float64", "gpu", marks=pytest.mark.gpu),
@@ -197,6 +231,41 @@ def test_data_types(
     assert distance_matrix.dtype.name == expected
 
 
+@pytest.mark.parametrize("metric", ["euclidean", "correlation"])
+def test_int8_missing_values(metric: MetricTypes) -> None:
+    x = get_vectors(dtype="i1").compute()
+    x[np.random.RandomState(0).rand(*x.shape) < 0.1] = -1
+    distance_matrix = pairwise_distance(x, metric=metric)
+    expected_matrix = pairwise_distance(x.astype("f8"), metric=metric).compute()
+    np.testing.assert_almost_equal(distance_matrix, expected_matrix)
+
+
+@pytest.mark.parametrize("metric", ["euclidean", "correlation"])
+def test_single_chunk(monkeypatch: pytest.MonkeyPatch, metric: MetricTypes) -> None:
+    monkeypatch.setattr("sgkit.distance.api.CPU_COUNT", 4)
+    x = get_vectors(array_type="np", dtype="f8", size=(30, 20))
+    x[np.random.RandomState(0).rand(*x.shape) < 0.1] = np.nan
+    distance_matrix = pairwise_distance(da.from_array(x), metric=metric)
+    assert distance_matrix.numblocks == (4, 4)
+    with dask.config.set(scheduler="threads"):
+        distance_matrix = distance_matrix.compute()
+    expected_matrix = create_distance_matrix(
+        x, euclidean if metric == "euclidean" else correlation
+    )
+    np.testing.assert_almost_equal(distance_matrix, expected_matrix)
+
+
+def test_correlation_constant_vectors() -> None:
+    x = get_vectors(array_type="np", dtype="f8", size=(4, 30))
+    x[:2] = 0.1
+    distance_matrix = pairwise_distance(x, metric="correlation").compute()
+    assert np.isnan(distance_matrix[:2]).all()
+    assert np.isnan(distance_matrix[:, :2]).all()
+    np.testing.assert_almost_equal(
+        distance_matrix[2:, 2:], squareform(pdist(x[2:], metric="correlation"))
+    )
+
+
 def test_undefined_metric() -> None:
     x = get_vectors(array_type="np")
     with pytest.raises(NotImplementedError):